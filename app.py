@@ -18,16 +18,33 @@ Author: Tyson Clegg
 Version: 2.0
 """
 
+from __future__ import annotations
+
+import functools
 import hashlib
+import hmac
 import os
 import re
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import numpy as np
-import openai
 import requests
 import streamlit as st
 
+if TYPE_CHECKING:
+    import openai
+
+from scryfall_helper import get_relevant_cards_context, match_card_names
+
+# Runs the Scryfall card lookup off the main thread so its network
+# round-trip overlaps with the Judge-Level retrieval (an OpenAI embeddings
+# call) instead of serializing ahead of it; stream_gpt_response resolves the
+# future only after retrieval. One worker suffices, and the helper it runs
+# uses plain lru_cache-backed functions, so no Streamlit cache is touched
+# from a thread without a script context.
+_CARD_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
 # Page configuration
 st.set_page_config(
     page_title="MTG Rules Assistant",
@@ -62,14 +79,86 @@ OMIT_SECTIONS = {
 #     "905",  # Conspiracy Draft (also contains the glossary as trailing content)
 }
 
+# Fallback candidate pattern: runs of capitalized words, possibly with
+# hyphens or apostrophes (e.g. "Lightning Bolt", "Urza's Saga"). Every word
+# in the run must start uppercase — allowing bare \s in the class would glue
+# the rest of the sentence into one giant candidate that the per-candidate
+# stopword filter could never reject. Compiled once at import.
+_CARD_RE = re.compile(r"\b[A-Z][a-zA-Z\-']*(?:\s+[A-Z][a-zA-Z\-']*)*")
+
+# Capitalized words common in rules questions that are never card-name hits.
+# A frozenset makes the per-candidate membership test O(1).
+_STOPWORDS = frozenset({
+    "the", "and", "or", "a", "an", "if", "is", "do", "does", "can",
+    "what", "when", "how", "why", "i", "my", "magic", "gathering",
+    "standard", "modern", "legacy", "commander", "limited", "upon",
+})
+
+
+def _extract_card_names_heuristic(text: str) -> list[str]:
+    """
+    Regex fallback for card-name extraction when the catalog is unavailable.
+
+    Heuristic: capitalized phrases that aren't common question words.
+
+    Args:
+        text: The user's question.
+
+    Returns:
+        Candidate card-name strings (unverified against the catalog).
+    """
+    candidates = _CARD_RE.findall(text)
+    return [
+        w for w in (c.strip() for c in candidates)
+        if len(w) > 2 and w.lower() not in _STOPWORDS
+    ]
+
+
+def extract_card_names(text: str) -> list[str]:
+    """
+    Extract card names from a question for Scryfall lookup.
+
+    Uses an exact token scan against Scryfall's card-name catalog, which
+    recognizes multi-word names like "Force of Will" and produces no false
+    positives; falls back to the capitalized-phrase heuristic if the catalog
+    could not be fetched. Capped at 5 names to bound the number of API lookups.
+
+    Args:
+        text: The user's question.
+
+    Returns:
+        Up to 5 card-name strings.
+    """
+    names = match_card_names(text)
+    if names is None:
+        names = _extract_card_names_heuristic(text)
+
+    # Dedupe case-insensitively before capping so repeated mentions of the
+    # same card don't consume lookup slots.
+    seen = set()
+    unique = []
+    for name in names:
+        key = name.lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(name)
+    return unique[:5]
+
 
 # Initialize OpenAI client (cached so it's only created once per session)
-@st.cache_resource
+@st.cache_resource(show_spinner=False)
 def init_openai_client():
     """
     Initialize OpenAI client with API key from environment variables or Streamlit secrets.
-    Cached with st.cache_resource so the client is reused across reruns.
+    Cached with st.cache_resource so the client — and its keep-alive HTTPS
+    connection pool — is reused across reruns, avoiding a TLS handshake per request.
     """
+    # Deferred import: the OpenAI SDK pulls in httpx2 and pydantic, which is
+    # wasted work during Streamlit's initial module import. Python caches the
+    # module, so calls after the first pay only a dict lookup.
+    import httpx2
+    import openai
+
     try:
         api_key = st.secrets.get("OPENAI_API_KEY")
     except Exception:
@@ -83,7 +172,12 @@ def init_openai_client():
         st.stop()
 
     if api_key.startswith("sk-"):
-        return openai.OpenAI(api_key=api_key)
+        # Explicit keep-alive limits so the pooled connections survive idle
+        # gaps between user questions.
+        http_client = httpx2.Client(
+            limits=httpx2.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+        )
+        return openai.OpenAI(api_key=api_key, http_client=http_client)
     else:
         st.error("❌ Invalid API key format. Expected an OpenAI key starting with 'sk-'.")
         st.stop()
@@ -162,6 +256,8 @@ def build_embeddings(rules_hash: str, api_key: str) -> tuple[list[str], np.ndarr
         shape (n_chunks, 1536) with L2-normalized rows for cosine similarity,
         or (None, None) on failure.
     """
+    import openai
+
     rules_text, _ = fetch_rules_text()
     if not rules_text:
         return None, None
@@ -230,34 +326,48 @@ def retrieve_relevant_chunks(
     return "\n\n".join(chunks[i] for i in top_indices_sorted)
 
 
-def get_gpt_response(
-        client: openai.OpenAI,
-        question: str,
-        card_context: Optional[str] = None,
-        format_type: str = "Any Format",
-        response_style: str = "Judge-Level",
-        chunks: Optional[list[str]] = None,
-        embeddings: Optional[np.ndarray] = None,
-    ) -> str:
+# All parameters derived from the response style, in one table so the prompt
+# instruction and sampling settings can't drift apart. Temperature stays 0
+# across the board — rules answers should be deterministic.
+_STYLE_CONFIG = {
+    "Extra-Concise": {
+        "instruction": "Be extremely concise. Answer in one or two sentences unless accuracy requires more. Bullet points are helpful.",
+        "max_tokens": 300,
+        "temperature": 0,
+    },
+    "Concise": {
+        "instruction": "Keep your answer brief and to the point. Don't include more detail than necessary. Bullet points are helpful.",
+        "max_tokens": 600,
+        "temperature": 0,
+    },
+    "Detailed": {
+        "instruction": "Provide a thorough explanation with examples.",
+        "max_tokens": 1200,
+        "temperature": 0,
+    },
+    "Judge-Level": {
+        "instruction": "Give a comprehensive, judge-quality answer with exact rule citations (e.g. CR 702.12b) and step-by-step breakdowns.",
+        "max_tokens": 4000,
+        "temperature": 0,
+    },
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _build_system_prompt(format_type: str, response_style: str) -> str:
     """
-    Get a response from GPT-4o-mini for an MTG rules question.
+    Build the static portion of the system prompt.
 
-    For Judge-Level responses, relevant rule sections are retrieved from the
-    pre-built RAG knowledge base and injected into the prompt, ensuring the
-    model always cites the current official rules. Other response styles use
-    training data, which is faster and sufficient for common questions.
+    The prompt only varies with (format_type, response_style) — a handful of
+    combinations — so it is memoized rather than re-formatted on every
+    request. Per-query rules context is appended by the caller.
 
     Args:
-        client: OpenAI client instance.
-        question: User's MTG rules question.
-        card_context: Optional card text from Scryfall API.
         format_type: MTG format (Any Format, Standard, Modern, etc.)
         response_style: Detail level (Extra-Concise, Concise, Detailed, Judge-Level).
-        chunks: Pre-built rule chunks from build_embeddings().
-        embeddings: Pre-built embedding matrix from build_embeddings().
 
     Returns:
-        GPT-4o-mini response as a formatted string.
+        System prompt string without the retrieved rules context.
     """
     format_context = (
         f"Focus on {format_type} format rules and interactions."
@@ -265,27 +375,10 @@ def get_gpt_response(
         else "Consider all formats when answering."
     )
 
-    style_instruction = {
-        "Extra-Concise": "Be extremely concise. Answer in one or two sentences unless accuracy requires more. Bullet points are helpful.",
-        "Concise": "Keep your answer brief and to the point. Don't include more detail than necessary. Bullet points are helpful.",
-        "Detailed": "Provide a thorough explanation with examples.",
-        "Judge-Level": "Give a comprehensive, judge-quality answer with exact rule citations (e.g. CR 702.12b) and step-by-step breakdowns.",
-    }.get(response_style, "Provide a detailed explanation.")
-
-    # For Judge-Level, retrieve the most relevant rule sections from the
-    # knowledge base and inject them directly into the prompt.
-    rules_context = ""
-    if response_style == "Judge-Level":
-        if chunks is None or embeddings is None:
-            return (
-                "❌ **Could not load the official MTG Comprehensive Rules.**\n\n"
-                "Please try switching to a different response style (Detailed, Concise, or Extra-Concise), "
-                "which will use the model's training data instead."
-            )
-        relevant = retrieve_relevant_chunks(client, question, chunks, embeddings)
-        rules_context = f"\n\n**Relevant Official MTG Comprehensive Rules:**\n{relevant}"
+    cfg = _STYLE_CONFIG.get(response_style, _STYLE_CONFIG["Detailed"])
+    style_instruction = cfg["instruction"]
 
-    system_prompt = f"""You are an expert Magic: The Gathering judge assistant.
+    return f"""You are an expert Magic: The Gathering judge assistant.
 
 **Format Context:** {format_context}
 **Response Style:** {style_instruction}
@@ -306,42 +399,93 @@ def get_gpt_response(
 **Format your answers with:**
 - A clear ruling summary upfront
 - Governing rule number(s) after the summary
-- Step-by-step breakdown for complex interactions{rules_context}"""
+- Step-by-step breakdown for complex interactions"""
+
+
+def stream_gpt_response(
+        client: openai.OpenAI,
+        question: str,
+        card_future: Optional[Future[str]] = None,
+        format_type: str = "Any Format",
+        response_style: str = "Judge-Level",
+        chunks: Optional[list[str]] = None,
+        embeddings: Optional[np.ndarray] = None,
+    ) -> Iterator[str]:
+    """
+    Stream a response from GPT-4o-mini for an MTG rules question.
+
+    The answer is yielded in text deltas as the model generates it, so the
+    first tokens appear in under a second instead of after the full
+    completion (5-15 s for Judge-Level answers). Errors are yielded as
+    formatted markdown strings so the caller can render them in place.
+
+    For Judge-Level responses, relevant rule sections are retrieved from the
+    pre-built RAG knowledge base and injected into the prompt, ensuring the
+    model always cites the current official rules. Other response styles use
+    training data, which is faster and sufficient for common questions.
+
+    Args:
+        client: OpenAI client instance.
+        question: User's MTG rules question.
+        card_future: Optional in-flight Scryfall lookup resolving to card
+            text; resolved only after the retrieval step so the two network
+            round-trips overlap.
+        format_type: MTG format (Any Format, Standard, Modern, etc.)
+        response_style: Detail level (Extra-Concise, Concise, Detailed, Judge-Level).
+        chunks: Pre-built rule chunks from build_embeddings().
+        embeddings: Pre-built embedding matrix from build_embeddings().
+
+    Yields:
+        Text deltas of the GPT-4o-mini response as they arrive.
+    """
+    # For Judge-Level, retrieve the most relevant rule sections from the
+    # knowledge base and inject them directly into the prompt.
+    rules_context = ""
+    if response_style == "Judge-Level":
+        if chunks is None or embeddings is None:
+            yield (
+                "❌ **Could not load the official MTG Comprehensive Rules.**\n\n"
+                "Please try switching to a different response style (Detailed, Concise, or Extra-Concise), "
+                "which will use the model's training data instead."
+            )
+            return
+        relevant = retrieve_relevant_chunks(client, question, chunks, embeddings)
+        rules_context = f"\n\n**Relevant Official MTG Comprehensive Rules:**\n{relevant}"
+
+    system_prompt = _build_system_prompt(format_type, response_style) + rules_context
+
+    # Resolve the card lookup only now — its Scryfall request has been in
+    # flight since the submit handler, overlapping with the retrieval
+    # embeddings round-trip above rather than serializing ahead of it.
+    card_context = card_future.result() if card_future is not None else None
 
     user_message = "**Question:** " + question
     if card_context:
         user_message += f"\n\n**Relevant card text:**\n{card_context}"
 
-    max_output_tokens = {
-        "Extra-Concise": 300,
-        "Concise": 600,
-        "Detailed": 1200,
-        "Judge-Level": 4000,
-    }.get(response_style, 2000)
+    cfg = _STYLE_CONFIG.get(response_style, _STYLE_CONFIG["Detailed"])
 
     try:
-        response = client.responses.create(
+        stream = client.responses.create(
             model="gpt-4o-mini",
             instructions=system_prompt,
             input=user_message,
-            max_output_tokens=max_output_tokens,
-            temperature=0,
+            max_output_tokens=cfg["max_tokens"],
+            temperature=cfg["temperature"],
+            stream=True,
         )
-        for block in response.output:
-            if block.type == "message":
-                for content in block.content:
-                    if content.type == "output_text":
-                        return content.text
-        return "❌ **No response returned.** Please try again."
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
     except Exception as e:
         error_msg = str(e)
         if "429" in error_msg and "rate_limit" in error_msg.lower():
-            return (
+            yield (
                 "❌ **Rate Limit Reached**\n\n"
                 "Too many requests in a short period. Please wait a moment and try again."
             )
         elif "insufficient_quota" in error_msg or "429" in error_msg:
-            return (
+            yield (
                 "❌ **API Quota Exceeded**\n\n"
                 "You've reached your OpenAI API usage limit. Please:\n\n"
                 "1. **Check your billing** at https://platform.openai.com/account/billing\n"
@@ -349,14 +493,86 @@ def get_gpt_response(
                 "3. **Try again later**"
             )
         elif "invalid_api_key" in error_msg:
-            return "❌ **Invalid API Key**\n\nPlease check your OpenAI API key in the .env file."
+            yield "❌ **Invalid API Key**\n\nPlease check your OpenAI API key in the .env file."
         else:
-            return f"❌ **Error getting response:** {error_msg}"
+            yield f"❌ **Error getting response:** {error_msg}"
+
+
+# Example questions for the sidebar buttons. A module-level tuple is
+# allocated once at import instead of rebuilt as a list on every rerun.
+_EXAMPLES: tuple[str, ...] = (
+    "How does indestructible interact with -1/-1 counters?",
+    "Can I counter a spell that can't be countered?",
+    "What happens when a creature with protection from red is targeted by a red spell?",
+    "How do multiple instances of the same ability work?",
+    "What's the difference between 'destroy' and 'exile'?",
+    "Can I respond to a triggered ability?",
+    "How does the stack work with multiple spells?",
+    "What happens if a creature loses all abilities?",
+)
+
+
+def check_password() -> bool:
+    """
+    Gate the app behind an optional shared password.
+
+    Only active when a password_sha256 secret (hex SHA-256 digest of the
+    password) is configured — without it the app stays open, so local runs
+    need no setup. The entered password is hashed and compared with
+    hmac.compare_digest, which runs in constant time regardless of where
+    the inputs differ, and only the digest of the secret is ever stored.
+
+    Returns:
+        True if no password is configured or the user has entered it.
+    """
+    try:
+        expected_hex = st.secrets.get("password_sha256")
+    except Exception:
+        expected_hex = None
+
+    if not expected_hex:
+        return True
+
+    # Validate the configured digest up front — a malformed secret should
+    # surface as a clear config error, not a ValueError mid-callback.
+    try:
+        expected = bytes.fromhex(str(expected_hex).strip())
+    except ValueError:
+        expected = b""
+    if len(expected) != hashlib.sha256().digest_size:
+        st.error("❌ The password_sha256 secret is not a valid SHA-256 hex digest (expected 64 hex characters).")
+        st.stop()
+
+    def password_entered():
+        entered = hashlib.sha256(st.session_state["password"].encode()).digest()
+        st.session_state["password_correct"] = hmac.compare_digest(entered, expected)
+        del st.session_state["password"]  # Don't keep the plaintext around
+
+    if st.session_state.get("password_correct"):
+        return True
+
+    st.text_input("Password", type="password", key="password", on_change=password_entered)
+    if st.session_state.get("password_correct") is False:
+        st.error("❌ Incorrect password.")
+    return False
+
+
+def _set_question(text: str) -> None:
+    """
+    Prefill the question input from an example button's on_click callback.
+
+    Callbacks run before the rerun renders, so the text area picks up the
+    value without a second full-script rerun via st.rerun().
+    """
+    st.session_state.question_input = text
 
 
 def main():
     """Main Streamlit app function."""
 
+    if not check_password():
+        return
+
     client = init_openai_client()
 
     st.title("🃏 MTG Rules Assistant")
@@ -414,47 +630,46 @@ def main():
         # Question input — pre-populated when an example button is clicked
         question = st.text_area(
             "Enter your MTG rules question:",
-            value=st.session_state.pop("example_question", ""),
+            key="question_input",
             placeholder="e.g., How does indestructible interact with -1/-1 counters?",
             height=120
         )
 
         if st.button("🔍 Get Answer", type="primary", use_container_width=True):
             if question.strip():
-                with st.spinner("Looking up the rules..."):
-                    card_context = None
-                    response = get_gpt_response(
-                        client, question, card_context,
-                        format_type, response_style,
-                        chunks, embeddings,
-                    )
-                    st.subheader("Answer")
-                    st.markdown(response)
+                # Kick off the Scryfall lookup immediately; it runs in the
+                # background while the answer section renders and is resolved
+                # only when the prompt actually needs the card text.
+                detected_cards = extract_card_names(question)
+                card_future = (
+                    _CARD_FETCH_EXECUTOR.submit(get_relevant_cards_context, detected_cards)
+                    if detected_cards else None
+                )
+                st.subheader("Answer")
+                st.write_stream(stream_gpt_response(
+                    client, question, card_future,
+                    format_type, response_style,
+                    chunks, embeddings,
+                ))
             else:
                 st.warning("Please enter a question.")
 
     with col2:
-        # Example questions
+        # Example questions — short integer-derived keys so Streamlit hashes
+        # a few characters per button instead of the full question text
         st.subheader("Examples")
-        examples = [
-            "How does indestructible interact with -1/-1 counters?",
-            "Can I counter a spell that can't be countered?",
-            "What happens when a creature with protection from red is targeted by a red spell?",
-            "How do multiple instances of the same ability work?",
-            "What's the difference between 'destroy' and 'exile'?",
-            "Can I respond to a triggered ability?",
-            "How does the stack work with multiple spells?",
-            "What happens if a creature loses all abilities?"
-        ]
-
-        for example in examples:
-            if st.button(example, key=example, use_container_width=True):
-                st.session_state.example_question = example
-                st.rerun()
-
-    # Footer
-    st.markdown("---")
-    st.caption("⚖️ This assistant provides guidance but is not a substitute for official MTG rules or judge rulings.")
+        for i, example in enumerate(_EXAMPLES):
+            st.button(
+                example,
+                key=f"ex{i}",
+                on_click=_set_question,
+                args=(example,),
+                use_container_width=True,
+            )
+
+    # Footer — separator and disclaimer in one element so each rerun sends a
+    # single front-end update instead of two
+    st.caption("---\n\n⚖️ This assistant provides guidance but is not a substitute for official MTG rules or judge rulings.")
 
 
 if __name__ == "__main__":
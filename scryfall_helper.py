@@ -3,42 +3,192 @@ Scryfall API helper functions for MTG Rules Assistant.
 This module provides functions to fetch card information from Scryfall API.
 """
 
-import scrython
+import functools
+import re
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
 from typing import Optional, Dict, Any
-import time
+from urllib3.util import Retry
 
-def search_card(card_name: str) -> Optional[Dict[str, Any]]:
+SCRYFALL_NAMED_URL = "https://api.scryfall.com/cards/named"
+SCRYFALL_COLLECTION_URL = "https://api.scryfall.com/cards/collection"
+SCRYFALL_CARD_NAMES_URL = "https://api.scryfall.com/catalog/card-names"
+
+# POST /cards/collection accepts at most 75 identifiers per request.
+_COLLECTION_MAX_IDENTIFIERS = 75
+
+# Tokenizer shared by the name index and the question scanner so both sides
+# normalize punctuation/hyphens the same way ("Dragon-God" -> "dragon", "god").
+_WORD_RE = re.compile(r"[\w']+")
+
+# One session for all Scryfall requests in the process — the underlying
+# urllib3 pool reuses connections, so repeat lookups skip DNS + TLS setup.
+# Transient 429/5xx responses are retried with exponential backoff (honoring
+# Retry-After) so a momentary rate-limit doesn't get cached as a permanent miss.
+_SESSION = requests.Session()
+_SESSION.headers.update({'User-Agent': 'mtg-chatbot/1.0', 'Accept': 'application/json'})
+_SESSION.mount('https://', HTTPAdapter(
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist={429, 500, 502, 503, 504},
+        allowed_methods={'GET', 'POST'},
+        respect_retry_after_header=True,
+    ),
+    pool_connections=10,
+    pool_maxsize=20,
+))
+
+@st.cache_resource(show_spinner=False)
+def _build_card_name_index() -> Dict[str, list]:
+    """
+    Build a token index of every Magic card name from Scryfall's catalog.
+
+    Downloads the card-names catalog (~2 MB, names only — far lighter than
+    the bulk card dump) once per process and indexes names by their first
+    token, with each bucket sorted longest-name-first for longest-match
+    scanning. Cached with st.cache_resource so reruns reuse the built index;
+    fetch failures raise instead of returning, because st.cache_resource
+    would otherwise pin the failure for the life of the process while a
+    raised exception is retried on the next call.
+
+    Returns:
+        Dictionary mapping first token to a list of (name_tokens, name)
+        tuples.
+
+    Raises:
+        requests.RequestException, KeyError, ValueError: if the catalog
+        could not be fetched or parsed.
+    """
+    response = _SESSION.get(SCRYFALL_CARD_NAMES_URL, timeout=30)
+    response.raise_for_status()
+    names = response.json()['data']
+
+    index: Dict[str, list] = {}
+    for name in names:
+        tokens = tuple(_WORD_RE.findall(name.lower()))
+        if tokens:
+            index.setdefault(tokens[0], []).append((tokens, name))
+    for entries in index.values():
+        entries.sort(key=lambda entry: len(entry[0]), reverse=True)
+    return index
+
+def match_card_names(text: str) -> Optional[list[str]]:
+    """
+    Find exact card names in text with a single linear token scan.
+
+    Walks the question's tokens once, trying the longest catalog name that
+    starts at each position — so multi-word names like "Force of Will" are
+    recognized exactly and non-card words never trigger lookups. Single-word
+    names must appear capitalized in the question to avoid false hits on
+    ordinary words that happen to be card names (e.g. "opt", "fog").
+
+    Args:
+        text: The user's question.
+
+    Returns:
+        List of matched card names in order of appearance (may contain
+        duplicates), or None if the name catalog is unavailable.
+    """
+    try:
+        index = _build_card_name_index()
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"Error fetching Scryfall card-name catalog: {str(e)}")
+        return None
+
+    raw_tokens = _WORD_RE.findall(text)
+    tokens = [t.lower() for t in raw_tokens]
+    found = []
+    i = 0
+    while i < len(tokens):
+        matched = False
+        for name_tokens, name in index.get(tokens[i], ()):
+            span = len(name_tokens)
+            if span == 1 and not raw_tokens[i][:1].isupper():
+                continue
+            if tuple(tokens[i:i + span]) == name_tokens:
+                found.append(name)
+                i += span
+                matched = True
+                break
+        if not matched:
+            i += 1
+    return found
+
+def _card_info_from_json(card: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract the fields this app uses from a Scryfall card object.
+
+    Args:
+        card: Raw card JSON from any Scryfall endpoint
+
+    Returns:
+        Dictionary containing the relevant card information
+    """
+    return {
+        'name': card.get('name'),
+        'mana_cost': card.get('mana_cost'),
+        'type_line': card.get('type_line'),
+        'oracle_text': card.get('oracle_text'),
+        'power': card.get('power'),
+        'toughness': card.get('toughness'),
+        'rarity': card.get('rarity'),
+        'set_name': card.get('set_name'),
+        'image_uris': card.get('image_uris')
+    }
+
+@functools.lru_cache(maxsize=4096)
+def _search_card_uncached(card_name: str) -> Optional[Dict[str, Any]]:
     """
     Search for a card by name using Scryfall API.
-    
+
+    The lru_cache layer serves non-Streamlit callers (scripts, tests) so
+    repeat lookups never hit the network even without a Streamlit runtime.
+    Only a genuine not-found (HTTP 404) returns None — transport errors
+    raise, so neither this cache nor the st.cache_data layer above ever
+    pins a transient failure as a 24-hour miss.
+
     Args:
         card_name: Name of the card to search for
-        
+
     Returns:
-        Dictionary containing card information or None if not found
+        Dictionary containing card information or None if Scryfall doesn't
+        know the name
+
+    Raises:
+        requests.RequestException, ValueError: if the request failed or the
+        response could not be parsed.
     """
-    try:
-        # Use Scrython to search for the card
-        card = scrython.cards.Named(fuzzy=card_name)
-        
-        # Extract relevant information
-        card_info = {
-            'name': card.name(),
-            'mana_cost': card.mana_cost(),
-            'type_line': card.type_line(),
-            'oracle_text': card.oracle_text(),
-            'power': card.power(),
-            'toughness': card.toughness(),
-            'rarity': card.rarity(),
-            'set_name': card.set_name(),
-            'image_uris': card.image_uris() if hasattr(card, 'image_uris') else None
-        }
-        
-        return card_info
-    
-    except Exception as e:
-        print(f"Error searching for card '{card_name}': {str(e)}")
+    response = _SESSION.get(SCRYFALL_NAMED_URL, params={'fuzzy': card_name}, timeout=5)
+    if response.status_code == 404:
+        # Scryfall's answer for an unknown name — a real miss, safe to cache
         return None
+    response.raise_for_status()
+    return _card_info_from_json(response.json())
+
+@st.cache_data(ttl=86400, show_spinner=False, persist="disk")
+def search_card(card_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Search for a card by name, caching results across reruns and restarts.
+
+    Oracle text is effectively immutable, so results are cached for 24 hours
+    and persisted to disk — repeat lookups cost zero network round-trips.
+    The name is normalized before the cache key so "Lightning Bolt" and
+    "lightning bolt " hit the same entry.
+
+    Args:
+        card_name: Name of the card to search for
+
+    Returns:
+        Dictionary containing card information or None if not found
+
+    Raises:
+        requests.RequestException, ValueError: if the request failed —
+        propagated so the failure is never cached; callers catch it.
+    """
+    return _search_card_uncached(card_name.strip().lower())
 
 def get_card_rules_text(card_name: str) -> Optional[str]:
     """
@@ -50,7 +200,11 @@ def get_card_rules_text(card_name: str) -> Optional[str]:
     Returns:
         Rules text as string or None if card not found
     """
-    card_info = search_card(card_name)
+    try:
+        card_info = search_card(card_name)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error searching for card '{card_name}': {str(e)}")
+        return None
     if card_info and card_info.get('oracle_text'):
         return card_info['oracle_text']
     return None
@@ -65,42 +219,108 @@ def format_card_info_for_context(card_name: str) -> Optional[str]:
     Returns:
         Formatted string with card information or None if not found
     """
-    card_info = search_card(card_name)
+    try:
+        card_info = search_card(card_name)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error searching for card '{card_name}': {str(e)}")
+        return None
     if not card_info:
         return None
-    
-    # Format the card information
-    context = f"Card: {card_info['name']}\n"
+    return _format_card_info(card_info)
+
+def _format_card_info(card_info: Dict[str, Any]) -> str:
+    """
+    Format a card-info dictionary for inclusion in GPT context.
+
+    Args:
+        card_info: Card information from search_card or a collection fetch
+
+    Returns:
+        Formatted string with the card's details
+    """
+    # Format the card information — collected in a list and joined once
+    # rather than built up with repeated string concatenation
+    parts = [f"Card: {card_info['name']}\n"]
     if card_info.get('mana_cost'):
-        context += f"Mana Cost: {card_info['mana_cost']}\n"
-    context += f"Type: {card_info['type_line']}\n"
+        parts.append(f"Mana Cost: {card_info['mana_cost']}\n")
+    parts.append(f"Type: {card_info['type_line']}\n")
     if card_info.get('oracle_text'):
-        context += f"Rules Text: {card_info['oracle_text']}\n"
+        parts.append(f"Rules Text: {card_info['oracle_text']}\n")
     if card_info.get('power') and card_info.get('toughness'):
-        context += f"Power/Toughness: {card_info['power']}/{card_info['toughness']}\n"
-    
-    return context
+        parts.append(f"Power/Toughness: {card_info['power']}/{card_info['toughness']}\n")
+
+    return "".join(parts)
+
+@functools.lru_cache(maxsize=512)
+def _fetch_cards_collection(card_names: tuple[str, ...]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetch card information for multiple names in one batched request.
+
+    All names go out in a single POST to Scryfall's /cards/collection
+    endpoint (up to 75 identifiers per request), so one HTTP round-trip
+    replaces one request per card and no pacing delay is needed. Collection
+    lookups are exact-name only, so names the endpoint doesn't recognize
+    (possible when the regex fallback extractor supplied them) are retried
+    individually through the fuzzy named-card lookup.
+
+    Cached with lru_cache rather than st.cache_data so it is safe to call
+    from worker threads, where Streamlit's caches have no script context.
+    Transport errors raise instead of returning, so the cache only ever
+    holds real responses — a None here always means Scryfall said not-found,
+    never that the network hiccuped.
+
+    Args:
+        card_names: Tuple of card names (hashable for the cache key)
+
+    Returns:
+        Dictionary mapping card names to their card information
+        (or None if not found)
+
+    Raises:
+        requests.RequestException, ValueError: if the request failed or the
+        response could not be parsed.
+    """
+    payload = {
+        'identifiers': [{'name': name} for name in card_names[:_COLLECTION_MAX_IDENTIFIERS]]
+    }
+    response = _SESSION.post(SCRYFALL_COLLECTION_URL, json=payload, timeout=10)
+    response.raise_for_status()
+    collection = response.json()
+
+    info_by_name = {
+        card['name'].lower(): _card_info_from_json(card)
+        for card in collection.get('data', [])
+    }
+    return {
+        name: info_by_name.get(name.lower()) or _search_card_uncached(name.lower())
+        for name in card_names
+    }
 
 def search_multiple_cards(card_names: list[str]) -> Dict[str, Optional[str]]:
     """
     Search for multiple cards and return their rules text.
-    
+
+    A thin wrapper over the batched collection fetch — one HTTP round-trip
+    for all names.
+
     Args:
         card_names: List of card names to search for
-        
+
     Returns:
         Dictionary mapping card names to their rules text (or None if not found)
     """
-    results = {}
-    
-    for card_name in card_names:
-        rules_text = get_card_rules_text(card_name)
-        results[card_name] = rules_text
-        
-        # Be nice to the API - add a small delay between requests
-        time.sleep(0.1)
-    
-    return results
+    if not card_names:
+        return {}
+
+    try:
+        card_infos = _fetch_cards_collection(tuple(card_names))
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error searching for cards {card_names}: {str(e)}")
+        return {name: None for name in card_names}
+    return {
+        name: info.get('oracle_text') if info else None
+        for name, info in card_infos.items()
+    }
 
 def get_relevant_cards_context(card_names: list[str]) -> str:
     """
@@ -114,14 +334,28 @@ def get_relevant_cards_context(card_names: list[str]) -> str:
     """
     if not card_names:
         return ""
-    
+
+    # Dedupe while preserving order — a question mentioning the same card
+    # three times should cost one lookup slot and one context block, not
+    # three. Normalization keeps the batch-fetch cache key stable.
+    card_names = list(dict.fromkeys(n.strip().lower() for n in card_names if n))
+
+    # One batched request for all cards instead of a /named GET per card.
+    # Transport errors surface here, outside the cache, so this turn just
+    # goes without card context and the next question retries.
+    try:
+        card_infos = _fetch_cards_collection(tuple(card_names))
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error searching for cards {card_names}: {str(e)}")
+        return ""
+
     context_parts = []
     for card_name in card_names:
-        card_context = format_card_info_for_context(card_name)
-        if card_context:
-            context_parts.append(card_context)
-    
+        card_info = card_infos.get(card_name)
+        if card_info:
+            context_parts.append(_format_card_info(card_info))
+
     if context_parts:
         return "\n---\n".join(context_parts)
-    
+
     return "" 
\ No newline at end of file
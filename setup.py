@@ -4,123 +4,302 @@ Setup script for MTG Rules Assistant.
 This script helps users set up their environment and get the app running.
 """
 
+import importlib.util
 import os
 import sys
-import subprocess
-import getpass
+
+# Fixed for the life of the interpreter — evaluated once at import
+_PY_OK = sys.version_info >= (3, 8)
+_PY_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
 
 def check_python_version():
     """Check if Python version is compatible."""
-    if sys.version_info < (3, 8):
+    if not _PY_OK:
         print("❌ Python 3.8 or higher is required.")
-        print(f"Current version: {sys.version}")
+        print(f"Current version: {_PY_VERSION}")
         return False
-    print(f"✅ Python version: {sys.version.split()[0]}")
+    print(f"✅ Python version: {_PY_VERSION}")
     return True
 
+# Stamp recording the requirements.txt hash from the last successful
+# dependency check, so unchanged re-runs skip the check entirely
+_REQS_STAMP_PATH = os.path.join('.setup-cache', 'reqs.hash')
+
+def _requirements_hash():
+    """Hash requirements.txt, or return None if it can't be read."""
+    import hashlib
+    try:
+        with open('requirements.txt', 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
 def check_dependencies():
     """Check if required packages are installed."""
-    required_packages = ['streamlit', 'openai', 'scrython']
-    missing_packages = []
-    
-    for package in required_packages:
+    import json
+    import subprocess
+
+    # Fast path: if requirements.txt hasn't changed since the last
+    # successful check, the answer hasn't either — one small file read
+    # replaces the pip subprocess
+    reqs_hash = _requirements_hash()
+    if reqs_hash:
         try:
-            __import__(package)
-            print(f"✅ {package} is installed")
-        except ImportError:
-            missing_packages.append(package)
+            with open(_REQS_STAMP_PATH) as f:
+                if f.read().strip() == reqs_hash:
+                    print("✅ Dependencies cached (requirements.txt unchanged)")
+                    return True
+        except OSError:
+            pass
+
+    required_packages = ['streamlit', 'openai', 'requests']
+
+    # One pip invocation answers "what's installed?" for all packages at
+    # once, straight from distribution metadata — no module code executes
+    # and sys.path is walked a single time
+    try:
+        installed = {
+            dist['name'].lower()
+            for dist in json.loads(subprocess.check_output(
+                [sys.executable, '-m', 'pip', 'list', '--format=json',
+                 '--disable-pip-version-check']
+            ))
+        }
+        missing_packages = [p for p in required_packages if p.lower() not in installed]
+    except (subprocess.CalledProcessError, ValueError):
+        # pip unavailable or unparseable output — fall back to spec probing
+        missing_packages = [
+            p for p in required_packages if importlib.util.find_spec(p) is None
+        ]
+
+    for package in required_packages:
+        if package in missing_packages:
             print(f"❌ {package} is missing")
+        else:
+            print(f"✅ {package} is installed")
     
     if missing_packages:
         print(f"\n📦 Installing missing packages: {', '.join(missing_packages)}")
         try:
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install'] + missing_packages)
+            # One resolver run over requirements.txt instead of per-package
+            # installs: wheels preferred (no sdist builds), no interactive
+            # prompts (CI-safe), and a persistent cache dir so re-runs in
+            # fresh environments don't re-download.
+            subprocess.check_call(
+                [
+                    sys.executable, '-m', 'pip', 'install',
+                    '--prefer-binary', '--no-input', '--disable-pip-version-check',
+                    '-r', 'requirements.txt',
+                ],
+                # dict unpacking rather than the | merge operator — the
+                # latter needs 3.9 while check_python_version allows 3.8
+                env={**os.environ, 'PIP_CACHE_DIR': os.path.expanduser('~/.cache/pip')},
+            )
             print("✅ All packages installed successfully!")
         except subprocess.CalledProcessError:
             print("❌ Failed to install packages. Please run: pip install -r requirements.txt")
             return False
-    
+
+    # Stamp this requirements.txt state so the next run can skip the check
+    if reqs_hash:
+        try:
+            os.makedirs(os.path.dirname(_REQS_STAMP_PATH), exist_ok=True)
+            with open(_REQS_STAMP_PATH, 'w') as f:
+                f.write(reqs_hash)
+        except OSError:
+            pass
+
     return True
 
-def setup_api_key():
+def _save_env_key(key, value):
+    """
+    Set one variable in .env, preserving everything else already there.
+
+    The previous open('.env', 'w') truncated the whole file, so re-running
+    setup to add a key wiped any other variables a user had stored. The
+    updated contents are written to a tempfile and swapped in with
+    os.replace, so a crash mid-write can never leave a half-written .env.
+    """
+    import tempfile
+
+    lines = []
+    if os.path.exists('.env'):
+        with open('.env') as f:
+            lines = f.read().splitlines()
+
+    new_line = f"{key}={value}"
+    replaced = False
+    for i, line in enumerate(lines):
+        if line.split('=', 1)[0].strip() == key:
+            lines[i] = new_line
+            replaced = True
+            break
+    if not replaced:
+        lines.append(new_line)
+
+    with tempfile.NamedTemporaryFile('w', dir='.', prefix='.env.', delete=False) as f:
+        f.write('\n'.join(lines) + '\n')
+        tmp_name = f.name
+    os.replace(tmp_name, '.env')
+
+def setup_api_key(args):
     """Set up OpenAI API key."""
     print("\n🔑 OpenAI API Key Setup")
     print("You need an OpenAI API key to use this app.")
     print("Get one at: https://platform.openai.com/api-keys")
-    
+
+    api_key = args.api_key
+
     # Check if API key is already set
-    if os.getenv("OPENAI_API_KEY"):
+    if not api_key and os.getenv("OPENAI_API_KEY"):
         print("✅ OPENAI_API_KEY is already set in environment")
         return True
-    
-    # Ask user for API key
-    api_key = getpass.getpass("Enter your OpenAI API key (input will be hidden): ").strip()
-    
+
+    # Ask user for API key (only in interactive runs)
+    if not api_key:
+        import getpass
+        api_key = getpass.getpass("Enter your OpenAI API key (input will be hidden): ").strip()
+
     if not api_key:
         print("❌ No API key provided. Please set OPENAI_API_KEY environment variable.")
         return False
-    
+
     if not api_key.startswith("sk-"):
         print("❌ Invalid API key format. OpenAI API keys start with 'sk-'")
         return False
-    
+
     # Set environment variable for current session
     os.environ["OPENAI_API_KEY"] = api_key
     print("✅ API key set for current session")
-    
-    # Ask if user wants to save to .env file
-    save_to_env = input("Save API key to .env file for future sessions? (y/n): ").lower().strip()
-    if save_to_env in ['y', 'yes']:
+
+    # Save to .env if requested; with --yes we never block on a prompt
+    if args.save_env:
+        save_to_env = True
+    elif args.yes:
+        save_to_env = False
+    else:
+        answer = input("Save API key to .env file for future sessions? (y/n): ").lower().strip()
+        save_to_env = answer in ['y', 'yes']
+    if save_to_env:
         try:
-            with open('.env', 'w') as f:
-                f.write(f"OPENAI_API_KEY={api_key}\n")
+            _save_env_key('OPENAI_API_KEY', api_key)
             print("✅ API key saved to .env file")
         except Exception as e:
             print(f"❌ Failed to save .env file: {e}")
-    
+
     return True
 
-def test_openai_connection():
+# Where the last successful connectivity probe is recorded, so re-running
+# setup.py doesn't repeat a billed network call for an unchanged key
+_PROBE_CACHE_PATH = os.path.expanduser('~/.cache/mtg-chatbot/probe.json')
+_PROBE_CACHE_TTL = 86400  # 24 hours
+
+# Lazily-imported OpenAI SDK, cached so repeated probes (retry loops, a
+# future wait-for-ready poller) reuse the module object directly
+_openai_mod = None
+
+def _get_openai():
+    """Import the OpenAI SDK on first use and reuse the module afterwards."""
+    global _openai_mod
+    if _openai_mod is None:
+        import openai
+        _openai_mod = openai
+    return _openai_mod
+
+def test_openai_connection(args):
     """Test OpenAI API connection."""
+    import hashlib
+    import json
+    import time
+
+    if args.skip_probe:
+        print("\n🧪 Skipping OpenAI API connection test (--skip-probe)")
+        return True
+
     print("\n🧪 Testing OpenAI API Connection...")
-    
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    # Skip the network round-trip if this same key probed successfully
+    # within the last 24 hours
     try:
-        import openai
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        # Simple test call
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": "Hello"}],
-            max_tokens=10
+        with open(_PROBE_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get('key_hash') == key_hash and time.time() - cached.get('ts', 0) < _PROBE_CACHE_TTL:
+            print("✅ OpenAI API connection verified recently (cached)")
+            return True
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import httpx2
+
+        openai = _get_openai()
+
+        # Shared pooled client: the single TLS handshake is reused if more
+        # probes (models list, embeddings warm-up) are ever added
+        http_client = httpx2.Client(
+            timeout=10.0,
+            limits=httpx2.Limits(max_keepalive_connections=4),
         )
-        
+        client = openai.OpenAI(api_key=api_key, http_client=http_client)
+
+        # Minimal probe: a plain GET that proves connectivity and key
+        # validity without generating (or billing) a single token
+        client.models.retrieve("gpt-4o-mini")
+
         print("✅ OpenAI API connection successful!")
-        return True
-        
+
     except Exception as e:
         print(f"❌ OpenAI API connection failed: {e}")
         return False
 
+    # Record the success atomically so a crash can't leave a torn cache file
+    try:
+        os.makedirs(os.path.dirname(_PROBE_CACHE_PATH), exist_ok=True)
+        tmp_path = _PROBE_CACHE_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key_hash': key_hash, 'ts': time.time()}, f)
+        os.replace(tmp_path, _PROBE_CACHE_PATH)
+    except OSError:
+        pass
+
+    return True
+
 def main():
     """Main setup function."""
+    import argparse
+
+    # Non-interactive flags so the script can run in CI/Docker build steps
+    # without stalling on getpass/input prompts
+    parser = argparse.ArgumentParser(description="Set up the MTG Rules Assistant.")
+    parser.add_argument('--api-key', help="OpenAI API key (skips the interactive prompt)")
+    parser.add_argument('--save-env', action='store_true',
+                        help="Save the API key to .env without asking")
+    parser.add_argument('--yes', action='store_true',
+                        help="Assume defaults for all prompts (never block on input)")
+    parser.add_argument('--skip-probe', action='store_true',
+                        help="Skip the OpenAI connectivity test")
+    args = parser.parse_args()
+
     print("🃏 MTG Rules Assistant Setup")
     print("=" * 40)
-    
+
     # Check Python version
     if not check_python_version():
         return False
-    
+
     # Check dependencies
     if not check_dependencies():
         return False
-    
+
     # Setup API key
-    if not setup_api_key():
+    if not setup_api_key(args):
         return False
-    
+
     # Test API connection
-    if not test_openai_connection():
+    if not test_openai_connection(args):
         return False
     
     print("\n🎉 Setup complete!")
@@ -131,5 +310,18 @@ def main():
     return True
 
 if __name__ == "__main__":
+    # Persist bytecode to __pycache__ so any import of this module (tooling,
+    # tests) skips re-parsing. py_compile never checks freshness itself, so
+    # only compile when the cached .pyc is missing or older than the source —
+    # direct script runs always parse from source regardless.
+    _pyc_path = importlib.util.cache_from_source(__file__)
+    try:
+        _pyc_fresh = os.path.getmtime(_pyc_path) >= os.path.getmtime(__file__)
+    except OSError:
+        _pyc_fresh = False
+    if not _pyc_fresh:
+        import py_compile
+        py_compile.compile(__file__, doraise=False)
+
     success = main()
     sys.exit(0 if success else 1) 
\ No newline at end of file